@@ -0,0 +1,30 @@
+# gunicorn.conf.py
+# Gunicorn settings for serving the bank simulator. Every value can be
+# overridden through environment variables. The database schema is created
+# beforehand by migrate.py, so workers do no setup work on start.
+
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5001")
+
+# Several worker processes. The default gevent worker runs each request in a
+# greenlet, so one process overlaps the database waits of many concurrent
+# requests; set GUNICORN_WORKER_CLASS=gthread to use OS threads instead.
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+# Hold idle HTTP/1.1 connections open so clients (or the nginx upstream pool,
+# see nginx.conf) reuse sockets instead of reconnecting for every request.
+# Keep this above the upstream keepalive_timeout in nginx.conf.
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "30"))
+
+
+def post_fork(server, worker):
+    """Makes psycopg2 yield to other greenlets while it waits on the database."""
+    # Check the worker class actually in use, which "-k" on the command line can override
+    if "gevent" in server.cfg.worker_class_str:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
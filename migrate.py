@@ -0,0 +1,13 @@
+# migrate.py
+# One-shot database setup: creates the 'accounts' table and seeds mock data.
+# Run once per deploy, before the web workers start:
+#   python migrate.py
+
+import sys
+
+from verse_bank import close_db_pool, init_db
+
+if __name__ == '__main__':
+    ok = init_db()
+    close_db_pool()
+    sys.exit(0 if ok else 1)
@@ -3,9 +3,32 @@
 # It uses a PostgreSQL database to store account information and pre-populates
 # it with mock data on first run.
 
+import hashlib
+import logging
+import math
 import os
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from cachetools import TTLCache
+import orjson
 import psycopg2
-from flask import Flask, request, jsonify
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2.extras import execute_values
+from flask import Flask, Response, request
+from pydantic import BaseModel, ValidationError, condecimal, constr
+
+# --- Logging ---
+# Per-step request logging is emitted at DEBUG; set LOG_LEVEL=DEBUG to see it.
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger("versebank")
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
@@ -13,104 +36,440 @@ app = Flask(__name__)
 # --- Global Request Logging (logs all incoming requests) ---
 @app.before_request
 def log_request_info():
-    """Logs details of every incoming HTTP request before it's processed by a route."""
-    print(f"[Versebank Incoming Request] Method: {request.method}, Path: {request.path}", flush=True)
+    """Logs method and path of every incoming HTTP request at DEBUG level; small bodies are logged raw, never parsed."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug("[Versebank Incoming Request] Method: %s, Path: %s", request.method, request.path)
     # Log headers for debugging, but be cautious with sensitive info in production
-    # print(f"  Headers: {request.headers}", flush=True)
-    if request.is_json:
-        try:
-            # Use silent=True to avoid errors if JSON is malformed
-            json_data = request.get_json(silent=True)
-            print(f"  JSON Data: {json_data}", flush=True)
-        except Exception as e:
-            print(f"  Error parsing JSON data: {e}", flush=True)
-    elif request.form:
-        print(f"  Form Data: {request.form}", flush=True)
+    # logger.debug("  Headers: %s", request.headers)
+    if request.content_length and request.content_length < 4096:
+        # get_data() caches the raw body, so handlers reuse it without another read
+        logger.debug("  Body: %s", request.get_data(as_text=True))
 
 
-def get_db_connection():
-    """Establishes a connection to the PostgreSQL database using environment variables, with no default values."""
+# --- Database Connection Settings ---
+def build_dsn():
+    """Builds the libpq connection string from environment variables, with no default values. Returns None if any is missing."""
     try:
-        conn = psycopg2.connect(
+        return psycopg2.extensions.make_dsn(
             dbname=os.environ["DB_NAME"],
             user=os.environ["DB_USER"],
             password=os.environ["DB_PASSWORD"],
             host=os.environ["DB_HOST"],
             port=os.environ["DB_PORT"]
         )
-        print("Database connection established.", flush=True)
-        return conn
     except KeyError as e:
-        print(f"Error: Missing environment variable: {e}. Please ensure all DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, and DB_PORT are set.", flush=True)
+        logger.error("Missing environment variable: %s. Please ensure all DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, and DB_PORT are set.", e)
         return None
-    except psycopg2.OperationalError as e:
-        print(f"Error: Could not connect to PostgreSQL database. Please check credentials and connection. Details: {e}", flush=True)
+
+# Read and validated once at import rather than on every connection attempt.
+DSN = build_dsn()
+
+
+# --- Database Connection Pool ---
+# Connections are opened once and reused across requests instead of paying the
+# TCP + authentication handshake on every call. The pool is created lazily so
+# that each process (e.g. every gunicorn worker) owns its own connections.
+POOL = None
+_pool_lock = threading.Lock()
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection that remembers which server-side prepared statements it has created."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class BlockingConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool that makes callers wait for a free connection when all
+    maxconn are checked out, instead of failing immediately with PoolError.
+    This matters with gevent workers, where far more requests than connections
+    can be in flight at once. Returned connections stay open up to maxconn
+    (not just minconn) so they, and their prepared statements, get reused.
+    """
+
+    def __init__(self, minconn, maxconn, *args, timeout=None, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._timeout = timeout
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise psycopg2.pool.PoolError("timed out waiting for a free connection")
+        try:
+            return super().getconn(key)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+    def _putconn(self, conn, key=None, close=False):
+        # Same as AbstractConnectionPool._putconn, except that the base class
+        # closes every connection returned while minconn are already idle.
+        # Here only broken connections, or close=True, are discarded.
+        if self.closed:
+            raise psycopg2.pool.PoolError("connection pool is closed")
+        if key is None:
+            key = self._rused.get(id(conn))
+            if key is None:
+                raise psycopg2.pool.PoolError("trying to put unkeyed connection")
+
+        if close or conn.closed:
+            conn.close()
+        elif conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            # Server connection lost
+            conn.close()
+        else:
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                self._pool.append(conn)
+            except psycopg2.Error:
+                conn.close()
+
+        del self._used[key]
+        del self._rused[id(conn)]
+
+
+def get_db_pool():
+    """Returns the process-wide connection pool, creating it on first use from DSN."""
+    global POOL
+    if POOL is not None:
+        return POOL
+    if DSN is None:
+        logger.error("Database settings are incomplete; no connection pool available.")
         return None
+    with _pool_lock:
+        if POOL is not None:
+            return POOL
+        try:
+            POOL = BlockingConnectionPool(
+                minconn=int(os.environ.get("DB_POOL_MIN", "4")),
+                maxconn=int(os.environ.get("DB_POOL_MAX", "32")),
+                timeout=float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+                dsn=DSN,
+                connection_factory=PreparingConnection
+            )
+            logger.info("Database connection pool established.")
+        except psycopg2.OperationalError as e:
+            logger.error("Could not connect to PostgreSQL database. Please check credentials and connection. Details: %s", e)
+        return POOL
+
+
+@contextmanager
+def db_conn(autocommit=False):
+    """
+    Checks a connection out of the pool for the duration of the block and
+    returns it afterwards. Yields None if the pool could not be created or
+    no connection is available.
+    Use autocommit=True for single-statement work (reads and atomic writes):
+    psycopg2 otherwise sends BEGIN and COMMIT/ROLLBACK as round-trips of their
+    own. Multi-statement work keeps the default transactional mode.
+    """
+    pool = get_db_pool()
+    if pool is None:
+        yield None
+        return
+    try:
+        conn = pool.getconn()
+    except psycopg2.Error as e:
+        logger.error("Could not check out a database connection. Details: %s", e)
+        yield None
+        return
+    try:
+        conn.autocommit = autocommit
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+def close_db_pool():
+    """Closes all pooled connections and discards the pool; the next checkout creates a fresh one."""
+    global POOL
+    with _pool_lock:
+        if POOL is not None:
+            POOL.closeall()
+            POOL = None
+
+# --- Account Cache ---
+# GET /account results are served from memory for a short TTL. Writes in this
+# process invalidate the entry; other workers may serve a stale balance for at
+# most ACCOUNT_CACHE_TTL seconds.
+ACCOUNT_CACHE = TTLCache(
+    maxsize=int(os.environ.get("ACCOUNT_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("ACCOUNT_CACHE_TTL", "1.0"))
+)
+_account_cache_lock = threading.Lock()
+
+
+def invalidate_cached_account(account_number):
+    """Drops any cached GET /account result for the given account number."""
+    with _account_cache_lock:
+        ACCOUNT_CACHE.pop(account_number, None)
+
+# --- Known Accounts Filter ---
+# Optional Bloom filter of existing account numbers that lets GET /account return
+# 404 for unknown accounts without a database round-trip. Each process loads it
+# from the database and adds the accounts it creates itself; accounts created by
+# other workers only show up after the next refresh, so a miss can be wrong for
+# that long. Only the read path trusts it (writes always ask the database), and
+# it is disabled unless ACCOUNT_FILTER_ENABLED=1.
+ACCOUNT_FILTER_ENABLED = os.environ.get("ACCOUNT_FILTER_ENABLED", "0") == "1"
+ACCOUNT_FILTER_CAPACITY = int(os.environ.get("ACCOUNT_FILTER_CAPACITY", "100000"))
+ACCOUNT_FILTER_ERROR_RATE = float(os.environ.get("ACCOUNT_FILTER_ERROR_RATE", "0.001"))
+ACCOUNT_FILTER_REFRESH = float(os.environ.get("ACCOUNT_FILTER_REFRESH", "60"))
+
+
+class AccountFilter:
+    """
+    Bloom filter over account numbers. A miss means the account number was never
+    added; a hit may be a false positive (at roughly error_rate up to capacity).
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, account_number):
+        digest = hashlib.blake2b(account_number.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, account_number):
+        for pos in self._positions(account_number):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, account_number):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(account_number))
+
+
+_account_filter = None
+_account_filter_lock = threading.Lock()
+_account_filter_refresher = None
+# Accounts created while a reload is running, re-applied to the fresh filter
+_account_filter_pending = None
+# Rebuilding yields every this many accounts so a gevent worker keeps serving requests
+_ACCOUNT_FILTER_YIELD_EVERY = 10000
+
+
+def refresh_account_filter():
+    """Rebuilds the account filter from the database. Returns False if the database is unavailable."""
+    global _account_filter, _account_filter_pending
+    with _account_filter_lock:
+        _account_filter_pending = set()
+    try:
+        with db_conn() as conn:
+            if not conn:
+                return False
+            try:
+                # A named (server-side) cursor streams the account numbers in batches
+                with conn.cursor(name="account_filter_load") as cur:
+                    cur.execute("SELECT account_number FROM accounts")
+                    account_numbers = [row[0] for row in cur]
+                conn.rollback()
+            except psycopg2.Error as e:
+                logger.error("Could not load the account filter: %s", e)
+                conn.rollback()
+                return False
+
+        new_filter = AccountFilter(max(ACCOUNT_FILTER_CAPACITY, 2 * len(account_numbers)), ACCOUNT_FILTER_ERROR_RATE)
+        for i, account_number in enumerate(account_numbers, start=1):
+            new_filter.add(account_number)
+            if i % _ACCOUNT_FILTER_YIELD_EVERY == 0:
+                time.sleep(0)
+        with _account_filter_lock:
+            for account_number in _account_filter_pending:
+                new_filter.add(account_number)
+            _account_filter = new_filter
+        logger.info("Account filter loaded with %d accounts.", len(account_numbers))
+        return True
+    finally:
+        with _account_filter_lock:
+            _account_filter_pending = None
+
+
+def _refresh_account_filter_forever():
+    """Background loop rebuilding the account filter every ACCOUNT_FILTER_REFRESH seconds."""
+    while True:
+        try:
+            refresh_account_filter()
+        except Exception:
+            logger.exception("Account filter refresh failed.")
+        time.sleep(ACCOUNT_FILTER_REFRESH)
+
+
+def start_account_filter_refresher():
+    """Starts this process's background filter refresher unless it is already running."""
+    global _account_filter_refresher
+    with _account_filter_lock:
+        if _account_filter_refresher is None:
+            _account_filter_refresher = threading.Thread(
+                target=_refresh_account_filter_forever, name="account-filter-refresh", daemon=True
+            )
+            _account_filter_refresher.start()
+
+
+def account_may_exist(account_number):
+    """
+    Returns False only when the account filter is enabled, loaded, and rules the
+    account out. Never touches the database: loading and refreshing happen in a
+    background thread, started here on first use so each worker runs its own.
+    """
+    if not ACCOUNT_FILTER_ENABLED:
+        return True
+    if _account_filter_refresher is None:
+        start_account_filter_refresher()
+    account_filter = _account_filter
+    return account_filter is None or account_number in account_filter
+
+
+def remember_account(account_number):
+    """Adds a newly created account to this process's account filter."""
+    if not ACCOUNT_FILTER_ENABLED:
+        return
+    with _account_filter_lock:
+        if _account_filter is not None:
+            _account_filter.add(account_number)
+        if _account_filter_pending is not None:
+            _account_filter_pending.add(account_number)
+
+# Statements used by the request handlers: name -> (argument types, SQL).
+# Each is prepared once per pooled connection so Postgres parses and plans it
+# only on first use instead of on every request.
+PREPARED_STATEMENTS = {
+    "create_account": ("text, numeric", "INSERT INTO accounts (account_number, balance) VALUES (%s, %s)"),
+    "get_account": ("text", "SELECT account_number, balance FROM accounts WHERE account_number = %s"),
+    "deposit": ("numeric, text", "UPDATE accounts SET balance = balance + %s WHERE account_number = %s RETURNING balance"),
+    "withdraw": ("numeric, text", "UPDATE accounts SET balance = balance - %s WHERE account_number = %s RETURNING balance"),
+}
+
+# SQL-level PREPARE is session state, which PgBouncer in transaction pooling mode
+# does not preserve between transactions. Set DB_PREPARE_STATEMENTS=0 when
+# connecting through such a pooler to send the plain statements instead.
+USE_PREPARED_STATEMENTS = os.environ.get("DB_PREPARE_STATEMENTS", "1") == "1"
+
+
+def execute_prepared(cur, name, params):
+    """Executes a statement from PREPARED_STATEMENTS, preparing it on the cursor's connection first if needed."""
+    arg_types, sql = PREPARED_STATEMENTS[name]
+    if not USE_PREPARED_STATEMENTS:
+        cur.execute(sql, params)
+        return
+    conn = cur.connection
+    if name not in conn.prepared:
+        # %s placeholders are positional, so number them in order for PREPARE
+        parts = sql.split("%s")
+        numbered = parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], start=1))
+        cur.execute(f"PREPARE {name} ({arg_types}) AS {numbered}")
+        conn.prepared.add(name)
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+# Rows per INSERT statement when seeding; larger seed sets are streamed in pages of this size.
+SEED_PAGE_SIZE = 2000
 
 def init_db():
     """
     Initializes the database:
     1. Creates the 'accounts' table if it doesn't exist.
-    2. Populates the table with mock accounts if it's empty.
+    2. Inserts the mock accounts that don't exist yet.
+    Meant to run once per deploy (see migrate.py), not on every worker start.
+    Returns True on success, False otherwise.
     """
-    conn = get_db_connection()
-    if not conn:
-        print("Database connection failed during initialization. Aborting.", flush=True)
-        return
+    with db_conn() as conn:
+        if not conn:
+            logger.error("Database connection failed during initialization. Aborting.")
+            return False
 
-    try:
-        with conn.cursor() as cur:
-            print("Attempting to create 'accounts' table if not exists...", flush=True)
-            # Step 1: Create table if it doesn't exist
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS accounts (
-                    id SERIAL PRIMARY KEY,
-                    account_number VARCHAR(255) UNIQUE NOT NULL,
-                    balance NUMERIC(15, 2) NOT NULL CHECK (balance >= 0)
-                );
-            """)
-            print("Database table 'accounts' presence checked.", flush=True)
-
-            # Step 2: Check if table is empty
-            cur.execute("SELECT COUNT(*) FROM accounts;")
-            count = cur.fetchone()[0]
-            print(f"Current number of accounts: {count}", flush=True)
-
-            # Step 3: Populate with mock data if empty
-            if count == 0:
-                print("No accounts found. Populating with mock data...", flush=True)
+        try:
+            with conn.cursor() as cur:
+                logger.debug("Attempting to create 'accounts' table if not exists...")
+                # Step 1: Create table if it doesn't exist. The advisory lock serializes
+                # concurrent initializers and is released when this transaction ends; both
+                # statements go to the server in a single round-trip.
+                # account_number is the primary key since every query looks accounts up by it;
+                # this leaves a single index instead of a surrogate key plus a UNIQUE index.
+                cur.execute("""
+                    SELECT pg_advisory_xact_lock(hashtext('versebank_init'));
+                    CREATE TABLE IF NOT EXISTS accounts (
+                        account_number VARCHAR(255) PRIMARY KEY,
+                        balance NUMERIC(15, 2) NOT NULL CHECK (balance >= 0)
+                    );
+                """)
+                logger.debug("Database table 'accounts' presence checked.")
+
+                # Step 2: Seed mock data. ON CONFLICT makes this safe to re-run without first
+                # checking whether the table is empty; existing accounts are left untouched.
                 mock_accounts = [
-                    ('1234567890', 5000.75),
-                    ('0987654321', 10250.00),
-                    ('5555555555', 732.10),
-                    ('1122334455', 25000.00)
+                    ('1234567890', Decimal('5000.75')),
+                    ('0987654321', Decimal('10250.00')),
+                    ('5555555555', Decimal('732.10')),
+                    ('1122334455', Decimal('25000.00'))
                 ]
-                # Use executemany for efficient batch insertion
-                cur.executemany(
-                    "INSERT INTO accounts (account_number, balance) VALUES (%s, %s)",
-                    mock_accounts
+                # Use execute_values to send the whole batch as a single multi-row INSERT
+                execute_values(
+                    cur,
+                    "INSERT INTO accounts (account_number, balance) VALUES %s ON CONFLICT (account_number) DO NOTHING",
+                    mock_accounts,
+                    page_size=SEED_PAGE_SIZE
                 )
-                print(f"{len(mock_accounts)} mock accounts have been created.", flush=True)
-            else:
-                print("Database already contains accounts. Skipping mock data insertion.", flush=True)
+                logger.info("%d mock accounts ensured present.", len(mock_accounts))
 
-            conn.commit()
-            print("Database initialization complete.", flush=True)
-    except psycopg2.Error as e:
-        print(f"Error during database initialization: {e}", flush=True)
-        if conn:
+                conn.commit()
+                logger.info("Database initialization complete.")
+                return True
+        except psycopg2.Error as e:
+            logger.error("Error during database initialization: %s", e)
             conn.rollback()
-            print("Database initialization: Transaction rolled back.", flush=True)
-    finally:
-        if conn:
-            conn.close()
-            print("Database connection closed after initialization.", flush=True)
-
-with app.app_context():
-    init_db()
+            logger.error("Database initialization: Transaction rolled back.")
+            return False
 
 # --- API Endpoints ---
 
+class ORJSONResponse(Response):
+    """Response carrying a body already serialized by orjson; being a fixed bytes body it is sent with Content-Length, never chunked."""
+    default_mimetype = "application/json"
+
+
+def ojsonify(obj, status=200):
+    """Serializes obj with orjson (much faster than the stdlib json used by flask.jsonify)."""
+    return ORJSONResponse(orjson.dumps(obj), status=status)
+
+
+# Request bodies are parsed, coerced and validated in one pass by pydantic's compiled core.
+AccountNumber = constr(min_length=1, max_length=255)
+# Amounts must fit the NUMERIC(15, 2) balance column exactly, so Postgres never
+# silently rounds away sub-cent digits or rejects an oversized value.
+AMOUNT_MAX_DIGITS = 15
+AMOUNT_DECIMAL_PLACES = 2
+
+
+class CreateAccountIn(BaseModel):
+    """Payload for POST /account."""
+    account_number: AccountNumber
+    initial_balance: condecimal(ge=0, allow_inf_nan=False, max_digits=AMOUNT_MAX_DIGITS, decimal_places=AMOUNT_DECIMAL_PLACES)
+
+
+class TransactionIn(BaseModel):
+    """Payload for POST /deposit and POST /withdrawal."""
+    account_number: AccountNumber
+    amount: condecimal(gt=0, allow_inf_nan=False, max_digits=AMOUNT_MAX_DIGITS, decimal_places=AMOUNT_DECIMAL_PLACES)
+
+
+def invalid_body_response(error):
+    """Builds the 400 response for a request body that failed validation."""
+    details = error.errors(include_url=False, include_context=False, include_input=False)
+    return ojsonify({"error": "Invalid request body", "details": details}, status=400)
+
 @app.route('/account', methods=['POST'])
 def create_account():
     """
@@ -119,48 +478,37 @@ def create_account():
     Returns: JSON response and HTTP status code.
     """
     # The @app.before_request decorator already logs the basic request info.
-    # This specific print confirms the request entered this route handler.
-    print(f"[Create Account] Processing request to create account.", flush=True)
-    data = request.get_json()
-    if not data or 'account_number' not in data or 'initial_balance' not in data:
-        print("[Create Account] Error: Missing account_number or initial_balance in request.", flush=True)
-        return jsonify({"error": "Missing account_number or initial_balance"}), 400
-
-    account_number = data['account_number']
+    # This specific log line confirms the request entered this route handler.
+    logger.debug("[Create Account] Processing request to create account.")
     try:
-        initial_balance = float(data['initial_balance'])
-        if initial_balance < 0:
-             print(f"[Create Account] Error: Initial balance cannot be negative ({initial_balance}).", flush=True)
-             return jsonify({"error": "Initial balance cannot be negative"}), 400
-    except ValueError:
-        print(f"[Create Account] Error: Invalid format for initial_balance ({data['initial_balance']}).", flush=True)
-        return jsonify({"error": "Invalid format for initial_balance"}), 400
-
-    conn = get_db_connection()
-    if not conn:
-        print("[Create Account] Error: Database connection failed.", flush=True)
-        return jsonify({"error": "Database connection failed"}), 500
+        body = CreateAccountIn.model_validate_json(request.get_data())
+    except ValidationError as e:
+        logger.debug("[Create Account] Error: Invalid request body: %s", e)
+        return invalid_body_response(e)
 
-    try:
-        with conn.cursor() as cur:
-            print(f"[Create Account] Inserting new account: {account_number}, balance: {initial_balance}", flush=True)
-            cur.execute(
-                "INSERT INTO accounts (account_number, balance) VALUES (%s, %s)",
-                (account_number, initial_balance)
-            )
-            conn.commit()
-            print(f"[Create Account] Account {account_number} created successfully.", flush=True)
-            return jsonify({"message": "Account created successfully", "account_number": account_number}), 201
-    except psycopg2.IntegrityError:
-        print(f"[Create Account] Error: Account with number {account_number} already exists.", flush=True)
-        return jsonify({"error": f"Account with number {account_number} already exists"}), 409
-    except psycopg2.Error as e:
-        print(f"[Create Account] Database error: {e}", flush=True)
-        return jsonify({"error": f"Database error: {e}"}), 500
-    finally:
-        if conn:
-            conn.close()
-            print("[Create Account] Database connection closed.", flush=True)
+    account_number = body.account_number
+    initial_balance = body.initial_balance
+
+    # A single INSERT is atomic on its own; autocommit sends and commits it in one round-trip
+    with db_conn(autocommit=True) as conn:
+        if not conn:
+            logger.error("[Create Account] Database connection failed.")
+            return ojsonify({"error": "Database connection failed"}, status=500)
+
+        try:
+            with conn.cursor() as cur:
+                logger.debug("[Create Account] Inserting new account: %s, balance: %s", account_number, initial_balance)
+                execute_prepared(cur, "create_account", (account_number, initial_balance))
+                invalidate_cached_account(account_number)
+                remember_account(account_number)
+                logger.debug("[Create Account] Account %s created successfully.", account_number)
+                return ojsonify({"message": "Account created successfully", "account_number": account_number}, status=201)
+        except psycopg2.IntegrityError:
+            logger.debug("[Create Account] Error: Account with number %s already exists.", account_number)
+            return ojsonify({"error": f"Account with number {account_number} already exists"}, status=409)
+        except psycopg2.Error as e:
+            logger.error("[Create Account] Database error: %s", e)
+            return ojsonify({"error": f"Database error: {e}"}, status=500)
 
 @app.route('/account/<string:account_number>', methods=['GET'])
 def get_account(account_number):
@@ -169,30 +517,38 @@ def get_account(account_number):
     Returns: JSON response and HTTP status code.
     """
     # The @app.before_request decorator already logs the basic request info.
-    print(f"[Get Account] Processing request to retrieve account {account_number}.", flush=True)
-    conn = get_db_connection()
-    if not conn:
-        print("[Get Account] Error: Database connection failed.", flush=True)
-        return jsonify({"error": "Database connection failed"}), 500
+    logger.debug("[Get Account] Processing request to retrieve account %s.", account_number)
+    with _account_cache_lock:
+        account = ACCOUNT_CACHE.get(account_number)
+    if account:
+        logger.debug("[Get Account] Account %s served from cache. Balance: %s", account_number, account[1])
+        return ojsonify({"account_number": account[0], "balance": str(account[1])})
+
+    if not account_may_exist(account_number):
+        logger.debug("[Get Account] Account %s not found (ruled out by account filter).", account_number)
+        return ojsonify({"error": "Account not found"}, status=404)
+
+    with db_conn(autocommit=True) as conn:
+        if not conn:
+            logger.error("[Get Account] Database connection failed.")
+            return ojsonify({"error": "Database connection failed"}, status=500)
 
-    try:
-        with conn.cursor() as cur:
-            print(f"[Get Account] Querying for account_number: {account_number}", flush=True)
-            cur.execute("SELECT account_number, balance FROM accounts WHERE account_number = %s", (account_number,))
-            account = cur.fetchone()
-            if account:
-                print(f"[Get Account] Account {account_number} found. Balance: {account[1]}", flush=True)
-                return jsonify({"account_number": account[0], "balance": str(account[1])})
-            else:
-                print(f"[Get Account] Account {account_number} not found.", flush=True)
-                return jsonify({"error": "Account not found"}), 404
-    except psycopg2.Error as e:
-        print(f"[Get Account] Database error: {e}", flush=True)
-        return jsonify({"error": f"Database error: {e}"}), 500
-    finally:
-        if conn:
-            conn.close()
-            print("[Get Account] Database connection closed.", flush=True)
+        try:
+            with conn.cursor() as cur:
+                logger.debug("[Get Account] Querying for account_number: %s", account_number)
+                execute_prepared(cur, "get_account", (account_number,))
+                account = cur.fetchone()
+                if account:
+                    logger.debug("[Get Account] Account %s found. Balance: %s", account_number, account[1])
+                    with _account_cache_lock:
+                        ACCOUNT_CACHE[account_number] = account
+                    return ojsonify({"account_number": account[0], "balance": str(account[1])})
+                else:
+                    logger.debug("[Get Account] Account %s not found.", account_number)
+                    return ojsonify({"error": "Account not found"}, status=404)
+        except psycopg2.Error as e:
+            logger.error("[Get Account] Database error: %s", e)
+            return ojsonify({"error": f"Database error: {e}"}, status=500)
 
 @app.route('/deposit', methods=['POST'])
 def deposit():
@@ -203,69 +559,46 @@ def deposit():
     Returns: JSON response and HTTP status code.
     """
     # The @app.before_request decorator already logs the basic request info.
-    print(f"[Deposit] Processing request to deposit funds.", flush=True)
-    data = request.get_json()
-    if not data or 'account_number' not in data or 'amount' not in data:
-        print("[Deposit] Error: Missing account_number or amount in request.", flush=True)
-        return jsonify({"error": "Missing account_number or amount"}), 400
-
-    account_number = data['account_number']
-    try:
-        amount = float(data['amount'])
-        if amount <= 0:
-            print(f"[Deposit] Error: Deposit amount must be positive ({amount}).", flush=True)
-            return jsonify({"error": "Deposit amount must be positive"}), 400
-    except ValueError:
-        print(f"[Deposit] Error: Invalid format for amount ({data['amount']}).", flush=True)
-        return jsonify({"error": "Invalid format for amount"}), 400
-
-    conn = get_db_connection()
-    if not conn:
-        print("[Deposit] Error: Database connection failed.", flush=True)
-        return jsonify({"error": "Database connection failed"}), 500
-
+    logger.debug("[Deposit] Processing request to deposit funds.")
     try:
-        with conn.cursor() as cur:
-            print(f"[Deposit] Attempting to lock account {account_number} for update...", flush=True)
-            # Lock the row for update to prevent race conditions
-            cur.execute(
-                "SELECT balance FROM accounts WHERE account_number = %s FOR UPDATE",
-                (account_number,)
-            )
-            account = cur.fetchone()
+        body = TransactionIn.model_validate_json(request.get_data())
+    except ValidationError as e:
+        logger.debug("[Deposit] Error: Invalid request body: %s", e)
+        return invalid_body_response(e)
 
-            if not account:
-                print(f"[Deposit] Account {account_number} not found.", flush=True)
-                return jsonify({"error": "Account not found"}), 404
+    account_number = body.account_number
+    amount = body.amount
 
-            current_balance = float(account[0])
-            new_balance = current_balance + amount
-            print(f"[Deposit] Account {account_number} found. Old Balance: {current_balance:.2f}, Deposit Amount: {amount:.2f}, Calculated New Balance: {new_balance:.2f}", flush=True)
+    # The UPDATE is atomic on its own; autocommit sends and commits it in one round-trip
+    with db_conn(autocommit=True) as conn:
+        if not conn:
+            logger.error("[Deposit] Database connection failed.")
+            return ojsonify({"error": "Database connection failed"}, status=500)
 
-            print(f"[Deposit] Updating balance for account {account_number}...", flush=True)
-            cur.execute(
-                "UPDATE accounts SET balance = %s WHERE account_number = %s",
-                (new_balance, account_number)
-            )
-            conn.commit()
-            print(f"[Deposit] Balance updated and transaction committed for account {account_number}. New Balance: {new_balance:.2f}", flush=True)
-
-            return jsonify({
-                "message": "Deposit successful",
-                "account_number": account_number,
-                "new_balance": str(new_balance)
-            }), 200
-
-    except psycopg2.Error as e:
-        print(f"[Deposit] Database transaction failed for account {account_number}: {e}", flush=True)
-        if conn:
-            conn.rollback()
-            print(f"[Deposit] Transaction rolled back for account {account_number}.", flush=True)
-        return jsonify({"error": f"Database transaction failed: {e}"}), 500
-    finally:
-        if conn:
-            conn.close()
-            print("[Deposit] Database connection closed.", flush=True)
+        try:
+            with conn.cursor() as cur:
+                logger.debug("[Deposit] Applying deposit of %s to account %s...", amount, account_number)
+                # A single atomic UPDATE holds the row lock only for the statement itself
+                execute_prepared(cur, "deposit", (amount, account_number))
+                account = cur.fetchone()
+
+                if not account:
+                    logger.debug("[Deposit] Account %s not found.", account_number)
+                    return ojsonify({"error": "Account not found"}, status=404)
+
+                invalidate_cached_account(account_number)
+                new_balance = account[0]
+                logger.debug("[Deposit] Balance updated and committed for account %s. New Balance: %s", account_number, new_balance)
+
+                return ojsonify({
+                    "message": "Deposit successful",
+                    "account_number": account_number,
+                    "new_balance": str(new_balance)
+                }, status=200)
+
+        except psycopg2.Error as e:
+            logger.error("[Deposit] Database transaction failed for account %s: %s", account_number, e)
+            return ojsonify({"error": f"Database transaction failed: {e}"}, status=500)
 
 @app.route('/withdrawal', methods=['POST'])
 def withdrawal():
@@ -276,81 +609,57 @@ def withdrawal():
     Returns: JSON response and HTTP status code.
     """
     # The @app.before_request decorator already logs the basic request info.
-    print(f"[Withdrawal] Processing request to withdraw funds.", flush=True)
-    data = request.get_json()
-    if not data or 'account_number' not in data or 'amount' not in data:
-        print("[Withdrawal] Error: Missing account_number or amount in request.", flush=True)
-        return jsonify({"error": "Missing account_number or amount"}), 400
-
-    account_number = data['account_number']
+    logger.debug("[Withdrawal] Processing request to withdraw funds.")
     try:
-        amount = float(data['amount'])
-        if amount <= 0:
-            print(f"[Withdrawal] Error: Withdrawal amount must be positive ({amount}).", flush=True)
-            return jsonify({"error": "Withdrawal amount must be positive"}), 400
-    except ValueError:
-        print(f"[Withdrawal] Error: Invalid format for amount ({data['amount']}).", flush=True)
-        return jsonify({"error": "Invalid format for amount"}), 400
-
-    conn = get_db_connection()
-    if not conn:
-        print("[Withdrawal] Error: Database connection failed.", flush=True)
-        return jsonify({"error": "Database connection failed"}), 500
+        body = TransactionIn.model_validate_json(request.get_data())
+    except ValidationError as e:
+        logger.debug("[Withdrawal] Error: Invalid request body: %s", e)
+        return invalid_body_response(e)
 
-    try:
-        with conn.cursor() as cur:
-            print(f"[Withdrawal] Attempting to lock account {account_number} for update...", flush=True)
-            # Lock the row for update to prevent race conditions
-            cur.execute(
-                "SELECT balance FROM accounts WHERE account_number = %s FOR UPDATE",
-                (account_number,)
-            )
-            account = cur.fetchone()
+    account_number = body.account_number
+    amount = body.amount
 
-            if not account:
-                print(f"[Withdrawal] Account {account_number} not found.", flush=True)
-                return jsonify({"error": "Account not found"}), 404
+    # The UPDATE is atomic on its own; autocommit sends and commits it in one round-trip
+    with db_conn(autocommit=True) as conn:
+        if not conn:
+            logger.error("[Withdrawal] Database connection failed.")
+            return ojsonify({"error": "Database connection failed"}, status=500)
 
-            current_balance = float(account[0])
-            new_balance = current_balance - amount # Subtract for withdrawal
-            print(f"[Withdrawal] Account {account_number} found. Old Balance: {current_balance:.2f}, Withdrawal Amount: {amount:.2f}, Calculated New Balance: {new_balance:.2f}", flush=True)
-
-
-            if new_balance < 0:
-                print(f"[Withdrawal] Error: Insufficient funds for withdrawal from {account_number}. Current: {current_balance:.2f}, Attempted: {amount:.2f}", flush=True)
-                return jsonify({"error": "Insufficient funds for this withdrawal"}), 400
-
-            print(f"[Withdrawal] Updating balance for account {account_number}...", flush=True)
-            cur.execute(
-                "UPDATE accounts SET balance = %s WHERE account_number = %s",
-                (new_balance, account_number)
-            )
-            conn.commit()
-            print(f"[Withdrawal] Balance updated and transaction committed for account {account_number}. New Balance: {new_balance:.2f}", flush=True)
-
-
-            return jsonify({
-                "message": "Withdrawal successful",
-                "account_number": account_number,
-                "new_balance": str(new_balance)
-            }), 200
-
-    except psycopg2.Error as e:
-        print(f"[Withdrawal] Database transaction failed for account {account_number}: {e}", flush=True)
-        if conn:
-            conn.rollback()
-            print(f"[Withdrawal] Transaction rolled back for account {account_number}.", flush=True)
-        return jsonify({"error": f"Database transaction failed: {e}"}), 500
-    finally:
-        if conn:
-            conn.close()
-            print("[Withdrawal] Database connection closed.", flush=True)
+        try:
+            with conn.cursor() as cur:
+                logger.debug("[Withdrawal] Applying withdrawal of %s from account %s...", amount, account_number)
+                # A single atomic UPDATE holds the row lock only for the statement itself;
+                # the CHECK (balance >= 0) constraint rejects overdrafts.
+                execute_prepared(cur, "withdraw", (amount, account_number))
+                account = cur.fetchone()
+
+                if not account:
+                    logger.debug("[Withdrawal] Account %s not found.", account_number)
+                    return ojsonify({"error": "Account not found"}, status=404)
+
+                invalidate_cached_account(account_number)
+                new_balance = account[0]
+                logger.debug("[Withdrawal] Balance updated and committed for account %s. New Balance: %s", account_number, new_balance)
+
+                return ojsonify({
+                    "message": "Withdrawal successful",
+                    "account_number": account_number,
+                    "new_balance": str(new_balance)
+                }, status=200)
+
+        except psycopg2.errors.CheckViolation:
+            logger.debug("[Withdrawal] Error: Insufficient funds for withdrawal from %s. Attempted: %s", account_number, amount)
+            return ojsonify({"error": "Insufficient funds for this withdrawal"}, status=400)
+        except psycopg2.Error as e:
+            logger.error("[Withdrawal] Database transaction failed for account %s: %s", account_number, e)
+            return ojsonify({"error": f"Database transaction failed: {e}"}, status=500)
 
 # --- Main Execution ---
 if __name__ == '__main__':
-    print("Starting bank simulator...", flush=True)
-    # The init_db() call is now at the module level within the app context
-    # Runs the Flask app. Use host='0.0.0.0' to make it accessible
-    # from other containers/machines on the same network.
-    app.run(host='0.0.0.0', port=5001, debug=True)
-
+    logger.info("Starting bank simulator...")
+    # Deployments run init_db() once via migrate.py; the dev server does it inline.
+    init_db()
+    # Runs the Flask development server for local use only; production traffic
+    # is served by gunicorn (see gunicorn.conf.py). Use host='0.0.0.0' to make it
+    # accessible from other containers/machines on the same network.
+    app.run(host='0.0.0.0', port=5001, debug=os.environ.get("FLASK_DEBUG", "0") == "1")